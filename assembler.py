@@ -1,13 +1,19 @@
 import argparse
+import mmap
+import os
 import re
+import struct
 from exceptions import *
-from utils import SymbolTable, write_inst_hex
+from utils import SymbolTable, DataSegment, write_inst_hex
 import utils
 
 TWO_POW_SEVENTEEN = 131072
 UINT16_MAX = 2**16 - 1
 INT16_MAX = 2**15 - 1
 INT16_MIN = -(2**15)
+UINT32_MAX = 2**32 - 1
+INT32_MAX = 2**31 - 1
+INT32_MIN = -(2**31)
 LONG_MAX = 2**63 - 1
 LONG_MIN = -(2**63)
 
@@ -33,11 +39,26 @@ def strip_comments(line):
 
     >>> strip_comments("Test#comment")
     'Test'
+
+    >>> strip_comments('.asciiz "#1" #comment')
+    '.asciiz "#1" '
     """
-    if "#" in line:
-        return line[:line.find("#")]
-    else:
+    if "#" not in line:
         return line
+    elif '"' not in line:
+        return line[:line.find("#")]
+    in_string = False
+    escaped = False
+    for i, c in enumerate(line):
+        if escaped:
+            escaped = False
+        elif in_string and c == "\\":
+            escaped = True
+        elif c == '"':
+            in_string = not in_string
+        elif c == "#" and not in_string:
+            return line[:i]
+    return line
 
 def tokenize(line):
     """Split up a line of text on spaces, new lines, tabs, commas, parens
@@ -69,6 +90,36 @@ def is_label(token):
     """
     return token[-1] == ":"
 
+def is_symbol(token):
+    """Returns True if this token can be used as a label name
+
+    >>> is_symbol("table")
+    True
+
+    >>> is_symbol("0x10")
+    False
+
+    >>> is_symbol("$t0")
+    False
+    """
+    return re.match("^[A-Za-z_][A-Za-z0-9_.]*$", token) is not None
+
+def parse_strings(line):
+    r"""Returns the contents of every double quoted string in the line as bytes,
+    with escape sequences translated
+
+    >>> parse_strings('.asciiz "Hello, world\\n"')
+    [b'Hello, world\n']
+
+    >>> parse_strings('.ascii "a", "b\\"c"')
+    [b'a', b'b"c']
+    """
+    strings = re.findall(r'"((?:[^"\\]|\\.)*)"', line)
+    try:
+        return [s.encode("utf-8").decode("unicode_escape").encode("latin-1") for s in strings]
+    except (UnicodeDecodeError, UnicodeEncodeError):
+        raise invalid_parameter()
+
 def raise_inst_error(line_num, name, args):
     print("Error on line {0}: {1}".format(line_num, name + " " + " ".join(args)))
 
@@ -155,6 +206,15 @@ def write_pass_one(name, args):
         else:
             return ["lui $at {0}".format((imm >> 16) & 0xffff),
                     "ori {0} $at {1}".format(args[0], imm & 0xffff)]
+    elif name == "la":
+        if len(args) != 2:
+            raise incorrect_number_of_parameters(name, len(args), 2)
+        if is_symbol(args[1]):
+            return ["lui $at {0}".format(args[1]),
+                    "ori {0} $at {1}".format(args[0], args[1])]
+        addr = translate_num(args[1], INT32_MIN, UINT32_MAX)
+        return ["lui $at {0}".format((addr >> 16) & 0xffff),
+                "ori {0} $at {1}".format(args[0], addr & 0xffff)]
     elif name == "move":
         if len(args) != 2:
             raise incorrect_number_of_parameters(name, len(args), 2)
@@ -210,7 +270,11 @@ def write_inst(output, opcode, args, addr, symtbl, reltbl, params, is_funct, imm
         elif param == SHAMT:
             inst = inst | (translate_num(arg, 0, 31) << 6)
         elif param == IMM:
-            inst = inst | (translate_num(arg, imm_min, imm_max) & 0xFFFF)
+            if not is_funct and opcode in (0x0d, 0x0f) and is_symbol(arg):
+                # lui/ori of a label, the linker fills in the address
+                reltbl.add(arg, addr)
+            else:
+                inst = inst | (translate_num(arg, imm_min, imm_max) & 0xFFFF)
         elif param == BRANCH_LABEL:
             label_addr = symtbl.get_addr(arg)
             if not can_branch_to(addr, label_addr):
@@ -332,33 +396,158 @@ def translate_inst(output, name, args, addr, symtbl, reltbl):
     else:
         raise translate_inst_error(name, args)
 
-def pass_one(lines, symtbl):
+data_alignment = {
+    ".half": 2,
+    ".word": 4,
+}
+
+def add_label(symtbl, other_symtbl, label, addr):
+    if other_symtbl.label_count(label) > 0:
+        raise duplicate_label_found(label)
+    symtbl.add(label, addr)
+
+def align_data(data, name, args):
+    if name == ".align":
+        if len(args) != 1:
+            raise incorrect_number_of_parameters(name, len(args), 1)
+        data.align(1 << translate_num(args[0], 0, 16))
+    else:
+        data.align(data_alignment.get(name, 1))
+
+def bind_data_labels(data, symtbl, labels):
+    while len(labels) > 0:
+        add_label(data.symtbl, symtbl, labels.pop(0), data.size())
+
+def pack_values(args, fmt, lower_bound, upper_bound):
+    """Packs a list of numbers into big endian bytes using a struct format character
+
+    >>> pack_values(["1", "-1", "0x1234"], "H", INT16_MIN, UINT16_MAX).hex()
+    '0001ffff1234'
+
+    >>> pack_values(["0xdeadbeef", "-2"], "I", INT32_MIN, UINT32_MAX).hex()
+    'deadbeeffffffffe'
+    """
+    mask = (1 << (struct.calcsize(fmt) * 8)) - 1
+    values = [translate_num(arg, lower_bound, upper_bound) & mask for arg in args]
+    return struct.pack(">{0}{1}".format(len(values), fmt), *values)
+
+def include_file(data, filename):
+    try:
+        with open(filename, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data.data += mm
+    except (OSError, ValueError):
+        raise include_file_error(filename)
+
+def write_data(data, name, args, line, base_dir):
+    if name == ".word":
+        values = []
+        relocations = []
+        for arg in args:
+            if is_symbol(arg):
+                relocations += [(arg, data.size() + len(values) * 4)]
+                values += ["0"]
+            else:
+                values += [arg]
+        data.data += pack_values(values, "I", INT32_MIN, UINT32_MAX)
+        # only once the words are written, a bad operand must not leave stray entries
+        for label, offset in relocations:
+            data.reltbl.add(label, offset)
+    elif name == ".half":
+        data.data += pack_values(args, "H", INT16_MIN, UINT16_MAX)
+    elif name == ".byte":
+        data.data += pack_values(args, "B", -128, 255)
+    elif name == ".space":
+        if len(args) != 1:
+            raise incorrect_number_of_parameters(name, len(args), 1)
+        data.data.extend(bytes(translate_num(args[0], 0, INT32_MAX)))
+    elif name == ".align":
+        # already applied by align_data
+        pass
+    elif name == ".ascii" or name == ".asciiz":
+        strings = parse_strings(line)
+        if len(strings) == 0:
+            raise invalid_parameter()
+        for string in strings:
+            data.data += string
+            if name == ".asciiz":
+                data.data.append(0)
+    elif name == ".incbin":
+        # the path must be quoted, relative paths start at the source file
+        strings = parse_strings(line)
+        if len(strings) != 1:
+            raise invalid_parameter()
+        include_file(data, os.path.join(base_dir, os.fsdecode(strings[0])))
+    else:
+        raise invalid_directive(name, "data")
+
+def pass_one(lines, symtbl, data, base_dir=""):
+    """Translates pseudo-instructions, collects labels and builds the data segment.
+    Data labels are bound after the alignment of the next data directive
+
+    >>> symtbl = SymbolTable(False)
+    >>> data = DataSegment()
+    >>> _ = pass_one([".data", ".byte 1", "table:", ".word 1, 2", "x: .align 3"], symtbl, data)
+    >>> data.symtbl.get_addr("table"), data.symtbl.get_addr("x"), data.size()
+    (4, 16, 16)
+
+    >>> data = DataSegment()
+    >>> _, errors = pass_one([".data", ".word main, 0x1ffffffff", ".byte 9"], symtbl, data)
+    >>> len(errors), data.reltbl.to_string(), data.data.hex()
+    (1, [], '09000000')
+    """
     errors = []
     ret_code = 0
     line_num = 0
     byte_off = 0
     intermediate = []
+    in_data = False
+    pending_labels = []
     for line in lines:
         try:
             line_num += 1
             name, args = tokenize(line)
             if name == "":
                 continue
+            label = None
             if is_label(name):
-                err = symtbl.add(name[:-1], byte_off)
-                if len(args) == 0:
-                    continue
-                name = args[0]
+                label = name[:-1]
+                name = args[0] if len(args) > 0 else ""
                 args = args[1:]
-            instructions = write_pass_one(name, args)
-            intermediate += instructions
-            byte_off += len(instructions) * 4
+            if in_data and label != None:
+                if label in pending_labels or symtbl.label_count(label) > 0 or data.symtbl.label_count(label) > 0:
+                    raise duplicate_label_found(label)
+                pending_labels += [label]
+            elif label != None:
+                add_label(symtbl, data.symtbl, label, byte_off)
+            if name == "":
+                continue
+            elif name == ".text" or name == ".data":
+                bind_data_labels(data, symtbl, pending_labels)
+                in_data = name == ".data"
+            elif in_data:
+                # labels go on the aligned address of the data that follows
+                align_data(data, name, args)
+                bind_data_labels(data, symtbl, pending_labels)
+                write_data(data, name, args, line, base_dir)
+            else:
+                instructions = write_pass_one(name, args)
+                intermediate += instructions
+                byte_off += len(instructions) * 4
         except AssemblerException as e:
             errors += [(line_num, e)]
             ret_code = -1
+    try:
+        bind_data_labels(data, symtbl, pending_labels)
+    except AssemblerException as e:
+        errors += [(line_num, e)]
+    # keep the next object file's data word aligned when linking
+    data.align(4)
     return intermediate, errors
 
-def pass_two(lines, symtbl, reltbl):
+def pass_two(lines, symtbl, reltbl, data):
     output = [".text"]
     errors = []
     line_num = 0
@@ -371,8 +560,11 @@ def pass_two(lines, symtbl, reltbl):
             byte_off += 4
         except AssemblerException as e:
             errors += [(line_num, e)]
+    output += ["", ".data"] + data.to_string()
     output += ["", ".symbol"] + symtbl.to_string()
+    output += ["", ".datasymbol"] + data.symtbl.to_string()
     output += ["", ".relocation"] + reltbl.to_string()
+    output += ["", ".datarelocation"] + data.reltbl.to_string()
     return output, errors
 
 def assemble(input_file):
@@ -380,10 +572,11 @@ def assemble(input_file):
     asm = [line for line in cleaned if line != ""]
     symtbl = SymbolTable(False)
     reltbl = SymbolTable(True)
+    data = DataSegment()
     # Pass One
-    intermediate, errors_one = pass_one(asm, symtbl)
+    intermediate, errors_one = pass_one(asm, symtbl, data, os.path.dirname(input_file))
     # Pass Two
-    output, errors_two = pass_two(intermediate, symtbl, reltbl)
+    output, errors_two = pass_two(intermediate, symtbl, reltbl, data)
 
     if len(errors_one) > 0:
         print("Errors during pass one:")
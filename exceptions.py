@@ -50,3 +50,11 @@ class translate_inst_error(AssemblerException):
     def __init__(self, name, args):
         AssemblerException.__init__(self, "{0}".format(name + " " + " ".join(args)))
 
+class invalid_directive(AssemblerException):
+    def __init__(self, name, segment):
+        AssemblerException.__init__(self, 'Directive "{0}" not valid in {1} segment'.format(name, segment))
+
+class include_file_error(AssemblerException):
+    def __init__(self, filename):
+        AssemblerException.__init__(self, 'Could not include file "{0}"'.format(filename))
+
@@ -1,68 +1,124 @@
 import argparse
+import struct
 from exceptions import *
-from utils import SymbolTable, write_inst_hex
+from utils import SymbolTable, write_inst_hex, read_data_hex
 import utils
 
-def inst_needs_relocation(instruction):
-    return (instruction >> 26) == 2 or (instruction >> 26) == 3
+table_sections = {
+    ".symbol": 0,
+    ".relocation": 1,
+    ".datasymbol": 2,
+    ".datarelocation": 3,
+}
 
-def relocate_inst(instruction, offset, symtbl, reltbl):
-    jump_addr = symtbl.get_addr(reltbl.get_label(offset))
-    return (instruction & 0xfc000000) | (jump_addr >> 2)
+def inst_needs_relocation(instruction, offset, relocs):
+    opcode = instruction >> 26
+    if opcode == 2 or opcode == 3:
+        return True
+    # lui/ori only when loading the address of a label
+    return (opcode == 0x0f or opcode == 0x0d) and offset in relocs
+
+def relocate_inst(instruction, offset, symtbl, relocs):
+    if offset not in relocs:
+        raise address_not_found(offset)
+    addr = symtbl.get_addr(relocs[offset])
+    opcode = instruction >> 26
+    if opcode == 0x0f:
+        return (instruction & 0xffff0000) | ((addr >> 16) & 0xffff)
+    elif opcode == 0x0d:
+        return (instruction & 0xffff0000) | (addr & 0xffff)
+    return (instruction & 0xfc000000) | (addr >> 2)
 
 def parse_table_entry(line):
     tokens = line.split("\t")
     return tokens[0], tokens[1]
 
-def build_tables(obj_code, symtbl, reltbls):
+def build_tables(obj_code, symtbl, relocs, data_reltbls):
     mode = None
     tables = []
-    for table in reltbls:
-        tables += [(symtbl, table)]
+    for i in range(0, len(obj_code)):
+        tables += [(symtbl, SymbolTable(True), symtbl, data_reltbls[i])]
+    # data of every object file is placed after all of the text
+    data_offset = 0
+    for obj_file in obj_code:
+        start, end = find_text_block(obj_file)
+        data_offset += (end - start) * 4
     global_offset = 0
     index = 0
     for obj_file in obj_code:
         for line in obj_file:
-            if line == ".symbol":
-                # mode = "symbol"
-                mode = 0
-            elif line == ".relocation":
-                # mode = "relocation"
-                mode = 1
+            if line in table_sections:
+                mode = table_sections[line]
+            elif line.startswith("."):
+                mode = None
             elif line != "" and mode != None:
                 # add this entry to the correct table
                 addr, label = parse_table_entry(line)
                 addr = int(addr)
                 if mode == 0:
                     addr += global_offset
+                elif mode == 2:
+                    addr += data_offset
                 tables[index][mode].add(label, addr)
         start, end = find_text_block(obj_file)
         global_offset += (end - start) * 4
+        data_offset += data_block_size(obj_file)
+        # {offset: label} so instructions can be relocated without a table scan
+        relocs += [dict((addr, label) for label, addr in tables[index][1].table)]
         mode = None
         index += 1
 
-def find_text_block(obj_code):
+def find_block(obj_code, name):
     start = 0
     end = 0
-    found_text = False
+    found_block = False
     index = 0
     for line in obj_code:
-        if line == ".text":
-            found_text = True
+        if line == name:
+            found_block = True
             start = index + 1
-        elif found_text and line == "":
+        elif found_block and line == "":
             end = index
-            found_text = False
+            found_block = False
         index += 1
     return start, end
 
+def find_text_block(obj_code):
+    return find_block(obj_code, ".text")
+
+def data_block_size(obj_code):
+    start, end = find_block(obj_code, ".data")
+    size = sum(len(line) for line in obj_code[start:end]) // 2
+    return size + (-size % 4)
+
+def read_data_block(obj_code):
+    start, end = find_block(obj_code, ".data")
+    data = read_data_hex(obj_code[start:end])
+    data.extend(bytes(-len(data) % 4))
+    return data
+
 def link(obj_code):
+    """Links a list of object files into a list of hex words, text followed by data
+
+    >>> obj = [".text", "3c010000", "34280000", "", ".data", "0000000100000000", "",
+    ...        ".symbol", "0\\tmain", "", ".datasymbol", "4\\ttable", "",
+    ...        ".relocation", "0\\ttable", "4\\ttable", "", ".datarelocation", "4\\ttable", ""]
+    >>> link([obj])
+    ['3c010000', '3428000c', '00000001', '0000000c']
+
+    >>> link([[".text", "03e00008", "", ".data", "", ".symbol", "0\\tmain", "",
+    ...        ".datarelocation", "0\\tmain", ""]])
+    Errors during linking:
+    Error: line 2: Could not find a label associated with address "0"
+    ['03e00008']
+    """
     # build symbol/relocation tables
     symtbl = SymbolTable(False)
-    reltbls = []
+    relocs = []
+    data_reltbls = []
     for i in range(0, len(obj_code)):
-        reltbls += [SymbolTable(True)]
-    build_tables(obj_code, symtbl, reltbls)
+        data_reltbls += [SymbolTable(True)]
+    build_tables(obj_code, symtbl, relocs, data_reltbls)
     # print(symtbl.to_string())
     # Find .text section of input
     byte_off = 0
@@ -77,14 +133,32 @@ def link(obj_code):
                 line_num += 1
                 # write instruction out
                 instruction = int(line, 16)
-                if inst_needs_relocation(instruction):
-                    instruction = relocate_inst(instruction, byte_off, symtbl, reltbls[index])
+                if inst_needs_relocation(instruction, byte_off, relocs[index]):
+                    instruction = relocate_inst(instruction, byte_off, symtbl, relocs[index])
                 write_inst_hex(output, instruction)
             except AssemblerException as e:
                 errors += [(line_num, e)]
             byte_off += 4
         index += 1
         byte_off = 0
+    # Append the .data section of each input, filling in label addresses
+    data = bytearray()
+    text_lines = line_num
+    index = 0
+    for obj_file in obj_code:
+        base = len(data)
+        block = read_data_block(obj_file)
+        data += block
+        for label, offset in data_reltbls[index].table:
+            try:
+                if offset < 0 or offset + 4 > len(block):
+                    raise address_not_found(offset)
+                struct.pack_into(">I", data, base + offset, symtbl.get_addr(label))
+            except AssemblerException as e:
+                errors += [(text_lines + (base + offset) // 4 + 1, e)]
+        index += 1
+    for (word,) in struct.iter_unpack(">I", data):
+        write_inst_hex(output, word)
     if len(errors) > 0:
         print("Errors during linking:")
         for line_num, e in errors:
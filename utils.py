@@ -1,9 +1,29 @@
 import os
 from exceptions import duplicate_label_found, multiple_label_definitions, label_not_found, address_not_found
 
+DATA_LINE_BYTES = 32
+
 def write_inst_hex(output, instruction):
     output += ["{:08x}".format(instruction)]
 
+def write_data_hex(output, data):
+    """Appends data to output as lines of hex, DATA_LINE_BYTES bytes per line
+
+    >>> output = []
+    >>> write_data_hex(output, bytearray(range(40)))
+    >>> len(output), output[1]
+    (2, '2021222324252627')
+
+    >>> read_data_hex(output) == bytearray(range(40))
+    True
+    """
+    view = memoryview(data)
+    for i in range(0, len(view), DATA_LINE_BYTES):
+        output += [view[i:i + DATA_LINE_BYTES].hex()]
+
+def read_data_hex(lines):
+    return bytearray.fromhex("".join(lines))
+
 def write_file_from_list(filename, string_list):
     with open(filename, 'w') as f:
         for line in string_list:
@@ -60,3 +80,32 @@ class SymbolTable:
         for k, v in self.table:
             output += [str(v) + "\t" + k]
         return output
+
+class DataSegment:
+    def __init__(self):
+        self.data = bytearray()
+        self.symtbl = SymbolTable(False)
+        self.reltbl = SymbolTable(True)
+
+    def size(self):
+        return len(self.data)
+
+    def align(self, boundary):
+        """Pads the data with zeros up to a multiple of boundary
+
+        >>> segment = DataSegment()
+        >>> segment.data.append(1)
+        >>> segment.align(4)
+        >>> segment.size(), segment.data.hex()
+        (4, '01000000')
+
+        >>> segment.align(4)
+        >>> segment.size()
+        4
+        """
+        self.data.extend(bytes(-len(self.data) % boundary))
+
+    def to_string(self):
+        output = []
+        write_data_hex(output, self.data)
+        return output